@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 import os
+import sys
+import atexit
+import contextvars
+import functools
+import hashlib
 import json
+import logging
+import logging.handlers
+import math
+import queue
 import re
+import uuid
+import zlib
 import asyncio
+import random
+import sqlite3
+import threading
+import time
 import aiohttp
 import discord
 from discord.ext import commands
 from discord import app_commands
-from groq import Groq
 from dotenv import load_dotenv
-from datetime import datetime
-import requests
+from datetime import datetime, timezone
+from collections import OrderedDict, deque
 
 load_dotenv()
 
@@ -19,13 +33,100 @@ DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 SUPERMEMORY_API_KEY = os.getenv('SUPERMEMORY_API_KEY')
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Sharding: "single" runs one plain bot, "auto" lets discord.py shard inside this
+# process, "process" is set by the main.py supervisor for each shard-group worker.
+SHARD_MODE = os.getenv('SHARD_MODE', 'single').lower()
+SHARD_COUNT = int(os.getenv('SHARD_COUNT') or 0) or None
+SHARD_IDS = [int(s) for s in os.getenv('SHARD_IDS', '').split(',') if s.strip()] or None
+
+# Cache shared by every bot process on this host
+SHARED_CACHE_PATH = os.getenv(
+    'SHARED_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'asklab_cache.db')
+)
+WIKI_CACHE_TTL = 6 * 3600
+PROFILE_CACHE_TTL = 300
+ANSWER_CACHE_TTL = 3600
+NEGATIVE_TITLE_TTL = 3600
+TITLE_INDEX_SIZE = 20000
+
+# Research time budget (seconds); guilds can override it with /time_budget
+DEFAULT_TIME_BUDGET = int(os.getenv('RESEARCH_TIME_BUDGET') or 90)
+FORCE_SYNTHESIS_SECONDS = 15
+LLM_TIMEOUT = 60
+
+# Memory held by all active research sessions; over the cap, tool payloads are
+# released aggressively
+SESSION_MEMORY_CAP = int(os.getenv('SESSION_MEMORY_CAP') or 64 * 1024 * 1024)
+TOOL_STUB_CHARS = 300
+
+# Identical prompts in a channel within this window share one research session
+DUPLICATE_WINDOW_SECONDS = 60
+
+# Channel history: the newest turns are sent verbatim, older ones are folded into
+# a rolling summary by a background task
+HISTORY_WINDOW = 4
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'llama-3.1-8b-instant')
+SUMMARY_TOKEN_BUDGET = 300
+# Most evicted messages a channel queues for compaction; older ones are dropped
+PENDING_COMPACTION_MAX = 24
+
+# Pages and searches a channel has recently used, offered to follow-up questions
+WORKING_SET_SIZE = 12
+WORKING_SET_TTL = 1800
+WORKING_SET_CHANNELS = 1000
+
+# Racing: hedge latency-critical LLM calls to the alternate model after the
+# primary's p90 latency; guilds can override these with /racing
+LLM_RACING = os.getenv('LLM_RACING', '').lower() in ("1", "true", "yes")
+LLM_HEDGE_HOURLY_LIMIT = int(os.getenv('LLM_HEDGE_HOURLY_LIMIT') or 20)
+
+# Sync slash commands even when their definitions are unchanged
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ("1", "true", "yes")
+
+# Groq quota per model; token budgets are re-synced from response headers
+GROQ_RPM = int(os.getenv('GROQ_RPM') or 30)
+GROQ_TPM = int(os.getenv('GROQ_TPM') or 6000)
+# Worker processes sharing the key (set by main.py); each paces to its share
+SHARD_WORKERS = max(1, int(os.getenv('SHARD_WORKERS') or 1))
+RATE_LIMIT_RETRIES = 3
+
+# Local mirror of memories written through add_memory
+MIRROR_MAX_ENTRIES = 500
+MIRROR_DIMS = 4096
+MIRROR_MIN_SCORE = 0.2
+MIRROR_CONFIDENT_SCORE = 0.45
+MIRROR_REFRESH_SECONDS = 300
+MIRROR_MAX_INDEXES = 256
+
+# Structured logging: per-event sample rates ("wiki.fetch=0.1,llm.completion=0.5")
+# and a cap on records per event type per second
+LOG_SAMPLING = {
+    name.strip(): float(rate)
+    for name, _, rate in (item.partition('=') for item in os.getenv('LOG_SAMPLING', '').split(',') if '=' in item)
+}
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT') or 50)
+
+_groq_client = None
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+if SHARD_MODE in ("auto", "process"):
+    bot = commands.AutoShardedBot(
+        command_prefix='!',
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
 
+startup_timings = {}
 conversation_history = {}
+channel_summaries = {}
+pending_compaction = {}
+compaction_tasks = {}
 user_model_preferences = {}
+guild_time_budgets = {}
 WIKI_HEADERS = {"User-Agent": "AskLabBot/2.0 (contact: admin@asklab.ai) aiohttp/3.8"}
 
 # Available models
@@ -33,8 +134,775 @@ AVAILABLE_MODELS = {
     "Llama 3.3 70B": "llama-3.3-70b-versatile",
     "Kimi K2 Instruct": "moonshotai/kimi-k2-instruct-0905"
 }
+DEFAULT_MODEL = "moonshotai/kimi-k2-instruct-0905"
+
+# --- LOGGING ---
+session_id_var = contextvars.ContextVar("session_id", default=None)
+user_id_var = contextvars.ContextVar("user_id", default=None)
+
+LOG_LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, event name and fields."""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage()
+        }
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+class EventLogger:
+    """Structured event logging that never blocks the event loop.
+
+    Records go onto a queue that a background thread writes to stdout. Each event
+    type can be sampled and is capped at a number of records per second; warnings
+    and errors are never sampled, and dropped counts are reported as log.dropped.
+    """
+
+    def __init__(self, sample_rates, rate_limit):
+        self.sample_rates = sample_rates
+        self.rate_limit = rate_limit
+        self.windows = {}
+        self.queue = queue.SimpleQueue()
+
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+        self.logger = logging.getLogger("asklab")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.logger.addHandler(logging.handlers.QueueHandler(self.queue))
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def _allow(self, event, level):
+        if level not in ("warning", "error"):
+            rate = self.sample_rates.get(event, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+
+        second = int(time.monotonic())
+        window = self.windows.get(event)
+        if window is None or window[0] != second:
+            if window and window[2]:
+                self._emit("log.dropped", "warning", {"dropped_event": event, "count": window[2]})
+            window = [second, 0, 0]
+            self.windows[event] = window
+        if window[1] >= self.rate_limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+    def _emit(self, event, level, fields):
+        self.logger.log(LOG_LEVELS[level], event, extra={"fields": fields})
+
+    def log(self, event, level="info", **fields):
+        if not self._allow(event, level):
+            return
+        session_id = session_id_var.get()
+        if session_id:
+            fields.setdefault("session", session_id)
+            fields.setdefault("user", user_id_var.get())
+        self._emit(event, level, fields)
+
+event_logger = EventLogger(LOG_SAMPLING, LOG_RATE_LIMIT)
+
+def log_event(event, level="info", **fields):
+    """Queue a structured log record; cheap enough for hot paths."""
+    event_logger.log(event, level, **fields)
+
+def get_groq_client():
+    """Build the Groq client on first use; importing the SDK is slow."""
+    global _groq_client
+    if _groq_client is None:
+        from groq import AsyncGroq
+        # The governor owns 429 handling, so the SDK must not retry on its own.
+        # The async client lets a cancelled session close its HTTP request.
+        _groq_client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+    return _groq_client
+
+# --- SHARED CACHE ---
+class SharedCache:
+    """SQLite-backed TTL cache shared by all shard processes on this host."""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        self.enabled = False
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            # WAL lets several processes read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "value TEXT NOT NULL, "
+                "expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+        except (sqlite3.Error, OSError) as e:
+            log_event("cache.disabled", "warning", error=str(e))
+            return
+
+        self.enabled = True
+        log_event("cache.ready", path=path)
+
+    def _get(self, namespace, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    def _set(self, namespace, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def _delete_prefix(self, namespace, prefix):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND substr(key, 1, ?) = ?",
+                (namespace, len(prefix), prefix)
+            )
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, fn, *args)
+        except (sqlite3.Error, ValueError) as e:
+            log_event("cache.error", "error", error=str(e))
+            return None
+
+    async def get(self, namespace, key):
+        """Return the cached value, or None if missing or expired."""
+        if not self.enabled:
+            return None
+        return await self._run(self._get, namespace, key)
+
+    async def set(self, namespace, key, value, ttl=None):
+        """Store a JSON-serializable value; ttl=None keeps it until overwritten."""
+        if not self.enabled:
+            return
+        await self._run(self._set, namespace, key, value, ttl)
+
+    async def delete_prefix(self, namespace, prefix):
+        """Drop every key in a namespace that starts with prefix."""
+        if not self.enabled:
+            return
+        await self._run(self._delete_prefix, namespace, prefix)
+
+shared_cache = SharedCache(SHARED_CACHE_PATH)
+
+async def get_user_model(user_id):
+    """Get a user's model preference, shared across shard processes."""
+    stored = await shared_cache.get("model_pref", str(user_id))
+    if stored:
+        user_model_preferences[user_id] = stored
+    return user_model_preferences.get(user_id, DEFAULT_MODEL)
+
+# --- DEADLINES ---
+class Deadline:
+    """Wall-clock budget for one research session, passed down to every call."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def fraction_left(self):
+        return self.remaining() / self.seconds if self.seconds else 0.0
+
+    def cap(self, timeout):
+        return min(timeout, self.remaining())
+
+    def reserving(self, seconds):
+        """A view of this budget that expires `seconds` early, keeping that slice for later work."""
+        view = Deadline(self.seconds)
+        view.expires_at = self.expires_at - seconds
+        return view
+
+async def get_time_budget(guild_id):
+    """Get a guild's research time budget in seconds."""
+    if guild_id is None:
+        return DEFAULT_TIME_BUDGET
+    stored = await shared_cache.get("time_budget", str(guild_id))
+    if stored:
+        guild_time_budgets[guild_id] = stored
+    return guild_time_budgets.get(guild_id, DEFAULT_TIME_BUDGET)
+
+def research_limits(deadline):
+    """Scale required pages and output length down as the budget runs out."""
+    left = deadline.fraction_left()
+    if left > 0.5:
+        return 3, 2000
+    if left > 0.25:
+        return 2, 1200
+    return 1, 800
+
+# --- RESILIENCE ---
+class BackendError(Exception):
+    """Raised when a backend answers with a retryable error status."""
+
+class CircuitOpenError(Exception):
+    """Raised when a backend's circuit breaker is rejecting calls."""
+
+class LatencyTracker:
+    """Rolling window of observed latencies for one endpoint."""
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        """Return the pct-th percentile in seconds, or None until enough samples exist."""
+        if len(self.samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one probe through after a cool-down."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log_event("circuit.closed", backend=self.name)
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            log_event("circuit.opened", "warning", backend=self.name, failures=self.failures)
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self):
+        """Hand back a probe that ended without a verdict so the next caller can probe."""
+        self.probing = False
+
+class Backend:
+    """Circuit breaker, adaptive timeout and request hedging for one endpoint."""
+
+    def __init__(self, name, default_timeout=10, min_timeout=2, max_timeout=15):
+        self.name = name
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(name)
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def timeout(self):
+        """Timeout derived from observed p99 latency, clamped to sane bounds."""
+        p99 = self.latency.percentile(99)
+        if p99 is None:
+            return self.default_timeout
+        return max(self.min_timeout, min(self.max_timeout, p99 * 3))
+
+    async def call(self, make_request, hedge=False, deadline=None):
+        """Run make_request(timeout) under this endpoint's breaker and timeout.
+
+        With hedge=True a duplicate request is sent once the first one has been
+        outstanding longer than the observed p95; only use it for idempotent reads.
+        A deadline caps the timeout to the caller's remaining budget.
+        """
+        timeout = self.timeout()
+        capped = False
+        if deadline is not None and deadline.remaining() < timeout:
+            timeout = deadline.remaining()
+            capped = True
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        hedge_delay = self.latency.percentile(95) if hedge else None
+        start = time.monotonic()
+        try:
+            if hedge_delay is not None and hedge_delay < timeout:
+                result = await self._hedged(make_request, timeout, hedge_delay)
+            else:
+                result = await asyncio.wait_for(make_request(timeout), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except asyncio.TimeoutError:
+            # Running out of the caller's budget says nothing about backend health
+            if capped:
+                self.breaker.release_probe()
+            else:
+                self.latency.record(time.monotonic() - start)
+                self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        self.latency.record(time.monotonic() - start)
+        self.breaker.record_success()
+        return result
+
+    async def _hedged(self, make_request, timeout, hedge_delay):
+        deadline = time.monotonic() + timeout
+        primary = asyncio.ensure_future(make_request(timeout))
+        tasks = [primary]
+        last_error = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            self.hedges_sent += 1
+            backup = asyncio.ensure_future(make_request(max(deadline - time.monotonic(), self.min_timeout)))
+            tasks.append(backup)
+            pending = {primary, backup}
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        raise last_error or asyncio.TimeoutError()
+
+wiki_backend = Backend("wikipedia", default_timeout=8, max_timeout=15)
+supermemory_backends = {
+    "search": Backend("supermemory_search"),
+    "profile": Backend("supermemory_profile"),
+    "documents": Backend("supermemory_documents")
+}
+
+# --- RATE LIMITING ---
+class RateLimitedError(Exception):
+    """Raised when Groq keeps rejecting a call after the governor's retries."""
+
+def parse_reset_seconds(value):
+    """Parse Groq reset durations such as '7.66s', '2m59.56s' or '120ms'."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        total += float(amount) * {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit]
+    return total or None
+
+class TokenBucket:
+    """Continuously refilling per-minute budget."""
+
+    def __init__(self, capacity, period=60):
+        self.capacity = capacity
+        self.period = period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be taken; oversized requests only wait for a full bucket."""
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed * self.period / self.capacity)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def sync(self, remaining, limit=None):
+        """Adopt the server's view of what is left."""
+        self._refill()
+        if limit:
+            self.capacity = limit
+        self.level = min(self.level, float(remaining))
+
+class RateLimitGovernor:
+    """Paces Groq calls for one model and API key so they stay under quota.
+
+    Calls queue in arrival order; the lock is held only while waiting for budget,
+    never for the request itself.
+    """
+
+    def __init__(self, name, rpm, tpm, share=1.0):
+        self.name = name
+        self.share = share
+        self.requests = TokenBucket(rpm * share)
+        self.tokens = TokenBucket(tpm * share)
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        self.paced_seconds = 0.0
+        self.rejections = 0
+
+    async def acquire(self, estimated_tokens, deadline=None):
+        async with self.lock:
+            while True:
+                wait = max(
+                    self.blocked_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens)
+                )
+                if wait <= 0:
+                    break
+                if deadline is not None and wait > deadline.remaining():
+                    raise asyncio.TimeoutError()
+                self.paced_seconds += wait
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+
+    def record_response(self, headers, estimated_tokens, used_tokens=None):
+        """Reconcile the estimate with actual usage and the rate-limit headers."""
+        if used_tokens is not None:
+            self.tokens.level += estimated_tokens - used_tokens
+
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None:
+            limit = headers.get("x-ratelimit-limit-tokens")
+            # Headers describe the whole key; this process only owns its share
+            self.tokens.sync(int(remaining_tokens) * self.share, int(limit) * self.share if limit else None)
+
+        # Groq's request headers describe the daily quota; stop until it resets
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            reset = parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def record_rejection(self, headers):
+        """Honor retry-after from a 429 and hold every queued call until then."""
+        self.rejections += 1
+        retry_after = parse_reset_seconds(headers.get("retry-after")) or parse_reset_seconds(
+            headers.get("x-ratelimit-reset-tokens")) or 1.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        log_event("groq.rate_limited", "warning", model=self.name, pause_s=round(retry_after, 2))
+
+rate_limit_governors = {}
+
+def get_governor(model_name):
+    """Get the shared governor for a model and the configured API key.
+
+    Worker processes split the quota evenly rather than coordinate per call.
+    """
+    key = (model_name, GROQ_API_KEY)
+    if key not in rate_limit_governors:
+        rate_limit_governors[key] = RateLimitGovernor(model_name, GROQ_RPM, GROQ_TPM, share=1 / SHARD_WORKERS)
+    return rate_limit_governors[key]
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token estimate for budgeting: ~4 characters per token plus the output cap."""
+    return len(json.dumps(messages, default=str)) // 4 + max_tokens
+
+# --- LOCAL MEMORY MIRROR ---
+STOPWORDS = frozenset(
+    "a an and are as at be by did do for from had has have how i in is it me my of on or "
+    "our so that the their them they this to was we were what when where which who why "
+    "will with you your".split()
+    # Saved exchanges are prefixed "User: ... Assistant: ...", so the roles match everything
+) | {"user", "assistant"}
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords."""
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOPWORDS]
+
+def embed_text(text):
+    """Feature-hashed embedding of words and character trigrams as a sparse unit vector.
+
+    crc32 is used instead of hash() so vectors match across processes.
+    """
+    vector = {}
+    for token in tokenize(text):
+        features = [(token, 1.0)]
+        if len(token) > 3:
+            features += [(token[i:i + 3], 0.5) for i in range(len(token) - 2)]
+        for feature, weight in features:
+            index = zlib.crc32(feature.encode()) % MIRROR_DIMS
+            vector[index] = vector.get(index, 0.0) + weight
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+class MemoryMirror:
+    """Per-container_tag copy of saved memories with a vector and keyword index.
+
+    Entries persist in the shared cache so every shard process sees them; the
+    indexes are rebuilt in memory on load and only the most recently used are kept.
+    """
+
+    def __init__(self, max_indexes=MIRROR_MAX_INDEXES):
+        self.max_indexes = max_indexes
+        self.indexes = OrderedDict()
+
+    def _store(self, container_tag, index):
+        self.indexes[container_tag] = index
+        self.indexes.move_to_end(container_tag)
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+
+    def _build(self, entries):
+        index = {"entries": entries, "vectors": [], "keywords": {}, "loaded_at": time.monotonic()}
+        for position, entry in enumerate(entries):
+            index["vectors"].append(embed_text(entry["content"]))
+            for token in set(tokenize(entry["content"])):
+                index["keywords"].setdefault(token, set()).add(position)
+        return index
+
+    async def _index(self, container_tag):
+        index = self.indexes.get(container_tag)
+        if index is None or time.monotonic() - index["loaded_at"] > MIRROR_REFRESH_SECONDS:
+            entries = await shared_cache.get("memory_mirror", container_tag) or []
+            index = self._build(entries)
+        self._store(container_tag, index)
+        return index
+
+    async def has_entries(self, container_tag):
+        return bool((await self._index(container_tag))["entries"])
+
+    async def add(self, container_tag, content, metadata=None, memory_id=None):
+        """Add one memory, skipping exact duplicates, and persist the mirror."""
+        await self.add_many(container_tag, [{"content": content, "metadata": metadata or {}, "id": memory_id}])
+
+    async def add_many(self, container_tag, items):
+        # Re-read before writing so memories saved by another process are kept
+        entries = await shared_cache.get("memory_mirror", container_tag) or []
+        known = {entry["content"] for entry in entries}
+        added = False
+        for item in items:
+            content = (item.get("content") or "").strip()
+            if not content or content in known:
+                continue
+            known.add(content)
+            entries.append({
+                "id": item.get("id"),
+                "content": content,
+                "metadata": item.get("metadata") or {},
+                "created": time.time()
+            })
+            added = True
+        if not added:
+            return
+        entries = entries[-MIRROR_MAX_ENTRIES:]
+        self._store(container_tag, self._build(entries))
+        await shared_cache.set("memory_mirror", container_tag, entries)
+
+    async def ingest(self, container_tag, results):
+        """Reconcile remote search results into the mirror."""
+        items = []
+        for result in results:
+            if isinstance(result, dict):
+                text = result.get('memory') or result.get('chunk') or result.get('content')
+                if text:
+                    items.append({"content": text, "metadata": result.get('metadata') or {}, "id": result.get('id')})
+        if items:
+            await self.add_many(container_tag, items)
+
+    @staticmethod
+    def is_confident(results):
+        """Whether local results are good enough to skip the remote search.
+
+        Only the score counts: several weak matches are no better than one.
+        """
+        return bool(results) and results[0]["similarity"] >= MIRROR_CONFIDENT_SCORE
+
+    async def search(self, container_tag, query, limit=5):
+        """Hybrid cosine + keyword top-k, shaped like /v4/search memory results."""
+        index = await self._index(container_tag)
+        if not index["entries"]:
+            return []
+
+        query_vector = embed_text(query)
+        query_tokens = set(tokenize(query))
+        overlap = {}
+        for token in query_tokens:
+            for position in index["keywords"].get(token, ()):
+                overlap[position] = overlap.get(position, 0) + 1
+
+        scored = []
+        for position, vector in enumerate(index["vectors"]):
+            cosine = sum(weight * vector.get(k, 0.0) for k, weight in query_vector.items())
+            keyword = overlap.get(position, 0) / len(query_tokens) if query_tokens else 0.0
+            score = 0.7 * cosine + 0.3 * keyword
+            if score >= MIRROR_MIN_SCORE:
+                scored.append((score, position))
+
+        scored.sort(reverse=True)
+        results = []
+        for score, position in scored[:limit]:
+            entry = index["entries"][position]
+            results.append({
+                "id": entry.get("id"),
+                "memory": entry["content"],
+                "metadata": entry.get("metadata", {}),
+                "similarity": score,
+                "source": "local"
+            })
+        return results
+
+memory_mirror = MemoryMirror()
+
+# --- REQUEST COALESCING ---
+class FlightDeadline:
+    """The longest remaining budget among the callers waiting on one shared call."""
+
+    def __init__(self):
+        self.deadlines = []
+
+    def remaining(self):
+        if any(d is None for d in self.deadlines):
+            return math.inf
+        return max((d.remaining() for d in self.deadlines), default=0.0)
+
+    def cap(self, timeout):
+        return min(timeout, self.remaining())
+
+class SingleFlight:
+    """Coalesces identical in-flight calls so followers await the leader's result.
+
+    The shared call runs as its own task under the longest deadline among its
+    waiters: a cancelled caller stops waiting without cancelling it for the others,
+    and it is only cancelled once nobody is waiting.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.leaders = 0
+        self.saved = 0
+
+    async def do(self, key, fn, deadline=None):
+        """Run fn(shared_deadline) once per key for all concurrent callers."""
+        while True:
+            call = self.calls.get(key)
+            if call is None:
+                call = {"deadline": FlightDeadline(), "waiters": 0}
+                call["task"] = asyncio.ensure_future(fn(call["deadline"]))
+                self.calls[key] = call
+                self.leaders += 1
+                call["task"].add_done_callback(lambda t, c=call: self._forget(key, c))
+            else:
+                self.saved += 1
+
+            task = call["task"]
+            call["waiters"] += 1
+            call["deadline"].deadlines.append(deadline)
+            try:
+                if deadline is None:
+                    return await asyncio.shield(task)
+                # Each caller still stops waiting at its own deadline
+                return await asyncio.wait_for(asyncio.shield(task), deadline.remaining())
+            except asyncio.TimeoutError:
+                self._abandon(key, call)
+                raise
+            except asyncio.CancelledError:
+                if not task.cancelled() or self._cancel_requested():
+                    self._abandon(key, call)
+                    raise
+                # The shared call was cancelled under us, not this caller: retry
+            finally:
+                call["waiters"] -= 1
+                call["deadline"].deadlines.remove(deadline)
+
+    def _abandon(self, key, call):
+        """Cancel the shared call when its last waiter leaves; later callers start afresh."""
+        if call["waiters"] == 1 and not call["task"].done():
+            if self.calls.get(key) is call:
+                del self.calls[key]
+            call["task"].cancel()
+
+    @staticmethod
+    def _cancel_requested():
+        current = asyncio.current_task()
+        cancelling = getattr(current, "cancelling", None)
+        # Without Task.cancelling() assume the cancellation was ours
+        return cancelling() > 0 if cancelling else True
+
+    def _forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        # Followers that were cancelled never retrieve the exception
+        if not call["task"].cancelled():
+            call["task"].exception()
+
+wiki_flight = SingleFlight("wikipedia")
+profile_flight = SingleFlight("supermemory_profile")
 
 # --- SUPERMEMORY CLIENT ---
+class SupermemoryResponse:
+    """A Supermemory reply read in full before its connection is closed."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
 class SupermemoryClient:
     def __init__(self, api_key):
         self.enabled = False
@@ -42,11 +910,32 @@ class SupermemoryClient:
         self.base_url = "https://api.supermemory.ai"
         
         if not api_key:
-            print("⚠️ SUPERMEMORY_API_KEY not set")
+            log_event("supermemory.disabled", "warning", reason="SUPERMEMORY_API_KEY not set")
             return
         
         self.enabled = True
-        print("✅ Supermemory client initialized")
+        log_event("supermemory.ready")
+    
+    async def _post(self, path, payload, backend, hedge=False, deadline=None):
+        """POST to Supermemory through the endpoint's breaker and adaptive timeout.
+        
+        Uses aiohttp so a cancelled session closes the request instead of leaving
+        it running in an executor thread.
+        """
+        async def attempt(timeout):
+            headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+            async with aiohttp.ClientSession(headers=headers) as session:
+                async with session.post(f"{self.base_url}{path}", json=payload,
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    response = SupermemoryResponse(resp.status, await resp.text())
+            if response.status_code >= 500 or response.status_code == 429:
+                raise BackendError(f"{path} returned {response.status_code}")
+            return response
+        
+        return await backend.call(attempt, hedge=hedge, deadline=deadline)
     
     async def test_connection(self):
         """Test if Supermemory connection works."""
@@ -54,28 +943,16 @@ class SupermemoryClient:
             return False
         
         try:
-            loop = asyncio.get_event_loop()
-            
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(
-                    f"{self.base_url}/v4/search",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={"q": "test", "limit": 1}
-                )
-            )
+            response = await self._post("/v4/search", {"q": "test", "limit": 1}, supermemory_backends["search"])
             
             if response.status_code == 200:
-                print(f"✅ Supermemory connection successful")
+                log_event("supermemory.test", ok=True)
                 return True
             else:
-                print(f"❌ Supermemory test failed: {response.status_code}")
+                log_event("supermemory.test", "warning", ok=False, status=response.status_code)
                 return False
         except Exception as e:
-            print(f"❌ Supermemory test failed: {e}")
+            log_event("supermemory.test", "error", ok=False, error=str(e))
             self.enabled = False
             return False
     
@@ -84,9 +961,10 @@ class SupermemoryClient:
         if not self.enabled:
             return None
         
+        # Mirror locally first so recall works even if the remote write fails
+        await memory_mirror.add(container_tag, content, metadata)
+        
         try:
-            loop = asyncio.get_event_loop()
-            
             # Prepare payload according to API documentation
             payload = {
                 "content": content,
@@ -98,36 +976,31 @@ class SupermemoryClient:
                 payload["metadata"] = metadata
             
             # Make API request
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(
-                    f"{self.base_url}/v3/documents",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-            )
+            response = await self._post("/v3/documents", payload, supermemory_backends["documents"])
             
             if response.status_code in [200, 201]:
-                print(f"✅ Memory saved: {content[:50]}...")
+                log_event("memory.saved", container=container_tag, chars=len(content))
+                await shared_cache.delete_prefix("profile", f"{container_tag}:")
                 return response.json()
             else:
-                print(f"❌ Supermemory add failed: {response.status_code} - {response.text}")
+                log_event("memory.save_failed", "error", container=container_tag, status=response.status_code, body=response.text[:200])
                 return None
         except Exception as e:
-            print(f"❌ Supermemory add error: {e}")
+            log_event("memory.save_failed", "error", container=container_tag, error=str(e))
             return None
     
-    async def search_memory(self, query, container_tag, limit=5):
-        """Search memories using the v4/search endpoint with hybrid mode."""
+    async def search_memory(self, query, container_tag, limit=5, deadline=None):
+        """Search memories, answering from the local mirror when it is confident and
+        falling back to the v4/search endpoint with hybrid mode."""
         if not self.enabled:
             return []
         
+        local_results = await memory_mirror.search(container_tag, query, limit)
+        if memory_mirror.is_confident(local_results):
+            log_event("memory.search", source="local", results=len(local_results))
+            return local_results
+        
         try:
-            loop = asyncio.get_event_loop()
-            
             # Prepare search payload
             payload = {
                 "q": query,
@@ -140,78 +1013,82 @@ class SupermemoryClient:
             }
             
             # Make API request
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(
-                    f"{self.base_url}/v4/search",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-            )
+            response = await self._post("/v4/search", payload, supermemory_backends["search"], hedge=True, deadline=deadline)
             
             if response.status_code == 200:
                 data = response.json()
                 # Extract results from response
                 results = data.get('results', [])
-                print(f"🔍 Memory search found {len(results)} results for '{query}'")
-                return results
+                log_event("memory.search", source="remote", results=len(results))
+                await memory_mirror.ingest(container_tag, results)
+                
+                # Keep local hits the remote search did not return
+                remote_texts = {r.get('memory') or r.get('chunk') for r in results if isinstance(r, dict)}
+                results += [r for r in local_results if r["memory"] not in remote_texts]
+                return results[:limit]
             else:
-                print(f"❌ Supermemory search failed: {response.status_code}")
-                return []
+                log_event("memory.search_failed", "error", status=response.status_code)
+                return local_results
         except Exception as e:
-            print(f"❌ Supermemory search error: {e}")
-            return []
+            log_event("memory.search_failed", "error", error=str(e))
+            return local_results
     
-    async def get_profile(self, container_tag, query=None):
+    async def get_profile(self, container_tag, query=None, deadline=None):
         """Get user profile using the v4/profile endpoint."""
         if not self.enabled:
             return None
         
-        try:
-            loop = asyncio.get_event_loop()
-            
-            # Prepare profile payload
-            payload = {
-                "containerTag": container_tag
-            }
+        cache_key = f"{container_tag}:{query or ''}"
+        cached = await shared_cache.get("profile", cache_key)
+        if cached is not None:
+            return cached
+        
+        async def load(deadline):
+            try:
+                # Prepare profile payload
+                payload = {
+                    "containerTag": container_tag
+                }
             
-            # Add optional search query
-            if query:
-                payload["q"] = query
+                # Add optional search query
+                if query:
+                    payload["q"] = query
             
-            # Make API request
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(
-                    f"{self.base_url}/v4/profile",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-            )
+                # Make API request
+                response = await self._post("/v4/profile", payload, supermemory_backends["profile"], hedge=True, deadline=deadline)
             
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ Profile retrieved for {container_tag}")
-                return data
-            else:
-                print(f"❌ Profile retrieval failed: {response.status_code}")
+                if response.status_code == 200:
+                    data = response.json()
+                    log_event("profile.fetched", container=container_tag)
+                    await shared_cache.set("profile", cache_key, data, PROFILE_CACHE_TTL)
+                    return data
+                else:
+                    log_event("profile.fetch_failed", "error", container=container_tag, status=response.status_code)
+                    return None
+            except Exception as e:
+                log_event("profile.fetch_failed", "error", container=container_tag, error=str(e))
                 return None
-        except Exception as e:
-            print(f"❌ Profile retrieval error: {e}")
+        
+        try:
+            return await profile_flight.do(cache_key, load, deadline)
+        except asyncio.TimeoutError:
+            log_event("profile.fetch_failed", "error", container=container_tag, error="deadline")
             return None
 
 # Initialize Supermemory client
 supermemory = SupermemoryClient(SUPERMEMORY_API_KEY) if SUPERMEMORY_API_KEY else None
 
+def memory_enabled():
+    return bool(supermemory and supermemory.enabled)
+
 # --- TOOL DEFINITIONS ---
+@functools.lru_cache(maxsize=None)
 def get_tools(include_memory=False):
-    """Get tool definitions, optionally including memory search."""
+    """Get tool definitions, optionally including memory search.
+
+    Built once per variant and returned as a tuple so every call sends
+    byte-identical schemas.
+    """
     base_tools = [
         {
             "type": "function",
@@ -258,38 +1135,135 @@ def get_tools(include_memory=False):
             }
         })
     
-    return base_tools
+    return tuple(base_tools)
 
 # --- WIKIPEDIA LOGIC ---
-async def fetch_wiki(params, retries=3):
+async def fetch_wiki(params, retries=3, deadline=None):
     """Fetch data from Wikipedia API with retries."""
     url = "https://en.wikipedia.org/w/api.php"
     params.update({"format": "json", "utf8": "1"})
     
-    for attempt in range(retries):
-        try:
+    cache_key = json.dumps(params, sort_keys=True)
+    cached = await shared_cache.get("wiki", cache_key)
+    if cached is not None:
+        return cached
+    
+    async def load(deadline):
+        async def attempt_fetch(timeout):
             async with aiohttp.ClientSession(headers=WIKI_HEADERS) as session:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-                    elif attempt < retries - 1:
-                        await asyncio.sleep(1 * (attempt + 1))
-        except (asyncio.TimeoutError, Exception) as e:
-            if attempt == retries - 1:
-                print(f"Error fetching Wikipedia: {e}")
-            elif attempt < retries - 1:
-                await asyncio.sleep(1 * (attempt + 1))
-    
-    return {"error": "Failed after maximum retries"}
-
-async def search_wikipedia(query):
+                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    if resp.status != 200:
+                        raise BackendError(f"Wikipedia returned {resp.status}")
+                    return await resp.json()
+        
+        for attempt in range(retries):
+            started = time.monotonic()
+            try:
+                data = await wiki_backend.call(attempt_fetch, hedge=True, deadline=deadline)
+                log_event("wiki.fetch", duration_ms=round((time.monotonic() - started) * 1000), attempt=attempt + 1)
+                if "error" not in data:
+                    await shared_cache.set("wiki", cache_key, data, WIKI_CACHE_TTL)
+                return data
+            except CircuitOpenError as e:
+                log_event("wiki.fetch_failed", "error", error=str(e))
+                return {"error": "Wikipedia is temporarily unavailable"}
+            except (asyncio.TimeoutError, Exception) as e:
+                if attempt == retries - 1 or (deadline and deadline.remaining() <= 0):
+                    log_event("wiki.fetch_failed", "error", error=str(e))
+                    break
+                else:
+                    # Short jittered backoff; the adaptive timeout already bounds each attempt
+                    await asyncio.sleep(0.5 * (attempt + 1) + random.uniform(0, 0.25))
+        
+        return {"error": "Failed after maximum retries"}
+    
+    try:
+        return await wiki_flight.do(cache_key, load, deadline)
+    except asyncio.TimeoutError:
+        return {"error": "Timed out waiting for Wikipedia"}
+
+# --- WIKIPEDIA TITLE INDEX ---
+class TitleIndex:
+    """Process-wide map from model-supplied titles to canonical page titles, plus
+    a TTL negative cache of titles known to be missing or empty.
+
+    Lookups are exact on a key normalized the way MediaWiki normalizes titles
+    (underscores, spacing, first letter only), never fuzzy.
+    """
+
+    def __init__(self, max_size=TITLE_INDEX_SIZE):
+        self.max_size = max_size
+        self.aliases = OrderedDict()
+        self.missing = {}
+        self.resolved = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def normalize(title):
+        # Titles are case-sensitive after the first letter: "Red dwarf" and
+        # "Red Dwarf" are different articles
+        title = ' '.join(title.replace('_', ' ').split())
+        return title[:1].upper() + title[1:]
+
+    def learn(self, alias, canonical):
+        key = self.normalize(alias)
+        if not key or not canonical:
+            return
+        self.aliases[key] = canonical
+        self.aliases.move_to_end(key)
+        self.missing.pop(key, None)
+        while len(self.aliases) > self.max_size:
+            self.aliases.popitem(last=False)
+
+    def learn_from_query(self, query):
+        """Learn from a MediaWiki query block's normalized/redirects lists and page titles."""
+        for mapping in query.get('normalized', []) + query.get('redirects', []):
+            self.learn(mapping.get('from', ''), mapping.get('to', ''))
+        for mapping in query.get('redirects', []):
+            # A normalized title that redirects should resolve straight to the target
+            for original in query.get('normalized', []):
+                if original.get('to') == mapping.get('from'):
+                    self.learn(original.get('from', ''), mapping.get('to', ''))
+        for page_id, page in query.get('pages', {}).items():
+            if not page_id.startswith('-') and page.get('title'):
+                self.learn(page['title'], page['title'])
+
+    def resolve(self, title):
+        canonical = self.aliases.get(self.normalize(title))
+        if not canonical:
+            return title
+        if canonical != title:
+            self.resolved += 1
+        return canonical
+
+    def mark_missing(self, *titles):
+        expires_at = time.monotonic() + NEGATIVE_TITLE_TTL
+        for title in titles:
+            self.missing[self.normalize(title)] = expires_at
+        if len(self.missing) > self.max_size:
+            now = time.monotonic()
+            self.missing = {k: v for k, v in self.missing.items() if v > now}
+
+    def is_missing(self, title):
+        expires_at = self.missing.get(self.normalize(title))
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self.missing[self.normalize(title)]
+            return False
+        self.negative_hits += 1
+        return True
+
+title_index = TitleIndex()
+
+async def search_wikipedia(query, deadline=None):
     """Search Wikipedia for articles."""
     data = await fetch_wiki({
         "action": "query",
         "list": "search",
         "srsearch": query,
         "srlimit": "5"
-    })
+    }, deadline=deadline)
     
     if not data or "error" in data:
         return f"Search failed: {data.get('error', 'Unknown error')}"
@@ -301,13 +1275,19 @@ async def search_wikipedia(query):
     results = []
     for i in items:
         title = i['title']
+        title_index.learn(title, title)
         snippet = re.sub(r'<[^>]+>', '', i.get('snippet', ''))
         results.append(f"• {title}: {snippet[:150]}")
     
     return "\n".join(results)
 
-async def get_wikipedia_page(title):
+async def get_wikipedia_page(title, deadline=None):
     """Retrieve full text of a Wikipedia page."""
+    requested = title
+    title = title_index.resolve(title)
+    if title_index.is_missing(requested) or title_index.is_missing(title):
+        return f"Page '{requested}' not found."
+    
     data = await fetch_wiki({
         "action": "query",
         "prop": "extracts",
@@ -315,17 +1295,19 @@ async def get_wikipedia_page(title):
         "exintro": "0",
         "titles": title,
         "redirects": "1"
-    })
+    }, deadline=deadline)
     
     if not data or "error" in data:
         return f"Failed to retrieve page: {data.get('error', 'Network error')}"
     
+    title_index.learn_from_query(data.get('query', {}))
     pages = data.get('query', {}).get('pages', {})
     if not pages:
         return f"No page data returned for '{title}'."
     
     for p_id, p_val in pages.items():
         if p_id == '-1':
+            title_index.mark_missing(requested, title)
             return f"Page '{title}' not found."
         
         extract = p_val.get('extract', '').strip()
@@ -337,7 +1319,7 @@ async def get_wikipedia_page(title):
                 "exintro": "1",
                 "titles": title,
                 "redirects": "1"
-            })
+            }, deadline=deadline)
             
             if data2 and "query" in data2:
                 pages2 = data2.get('query', {}).get('pages', {})
@@ -345,6 +1327,7 @@ async def get_wikipedia_page(title):
                     extract2 = p_val2.get('extract', '').strip()
                     if extract2:
                         return extract2[:3000]
+                title_index.mark_missing(requested, title, p_val.get('title', title))
             
             return f"Page '{title}' exists but has no readable text content."
         
@@ -416,8 +1399,13 @@ def convert_to_past_tense(sections):
     return converted
 
 # --- SYSTEM PROMPTS ---
+@functools.lru_cache(maxsize=None)
 def get_system_prompt(model_name, has_memory=False):
-    """Get model-specific system prompt."""
+    """Get model-specific system prompt.
+
+    The result is cached per (model, memory) pair and never carries per-user
+    text, so it forms a byte-stable prefix for provider-side prompt caching.
+    """
     memory_instruction = ""
     if has_memory:
         memory_instruction = (
@@ -509,6 +1497,7 @@ class ModelDropdown(discord.ui.Select):
         
         selected_model = self.values[0]
         user_model_preferences[self.user_id] = selected_model
+        await shared_cache.set("model_pref", str(self.user_id), selected_model)
         
         model_names = {v: k for k, v in AVAILABLE_MODELS.items()}
         model_display = model_names.get(selected_model, selected_model)
@@ -522,7 +1511,7 @@ class ModelDropdown(discord.ui.Select):
 @bot.tree.command(name="model", description="Select AI model")
 async def select_model(interaction: discord.Interaction):
     view = ModelSelectView(interaction.user.id)
-    current_model = user_model_preferences.get(interaction.user.id, "moonshotai/kimi-k2-instruct-0905")
+    current_model = await get_user_model(interaction.user.id)
     model_names = {v: k for k, v in AVAILABLE_MODELS.items()}
     current_display = model_names.get(current_model, current_model)
     
@@ -564,39 +1553,731 @@ async def memory_stats(interaction: discord.Interaction):
         
         await interaction.response.send_message(stats_msg, ephemeral=True)
 
-@bot.event
-async def on_ready():
-    print(f'✅ Bot Online: {bot.user}')
+@bot.tree.command(name="time_budget", description="Set the maximum research time for this server")
+@app_commands.describe(seconds="Maximum seconds a research answer may take")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.guild_only()
+async def time_budget(interaction: discord.Interaction, seconds: app_commands.Range[int, 30, 600]):
+    guild_time_budgets[interaction.guild_id] = seconds
+    await shared_cache.set("time_budget", str(interaction.guild_id), seconds)
+    
+    await interaction.response.send_message(
+        f"⏱️ Research time budget set to **{seconds}s**",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="racing", description="Race slow answers against the alternate model")
+@app_commands.describe(
+    enabled="Send a hedge request to the alternate model when the primary is slow",
+    hourly_limit="Maximum hedge requests per hour for this server"
+)
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.guild_only()
+async def racing(interaction: discord.Interaction, enabled: bool, hourly_limit: app_commands.Range[int, 0, 500] = LLM_HEDGE_HOURLY_LIMIT):
+    await shared_cache.set("racing", str(interaction.guild_id), {"enabled": enabled, "hourly_limit": hourly_limit})
+    
+    status = f"on, up to **{hourly_limit}** hedges/hour" if enabled else "off"
+    await interaction.response.send_message(f"🏁 Model racing is {status}", ephemeral=True)
+
+@bot.tree.command(name="backend_stats", description="Show backend health and request savings")
+@app_commands.default_permissions(manage_guild=True)
+async def backend_stats(interaction: discord.Interaction):
+    lines = ["📊 **Backend Stats**\n"]
+    for flight in (wiki_flight, profile_flight):
+        lines.append(f"🔗 **{flight.name}**: {flight.saved} coalesced / {flight.leaders} sent")
+    for backend in [wiki_backend] + list(supermemory_backends.values()):
+        p95 = backend.latency.percentile(95)
+        p95_text = f"{p95 * 1000:.0f}ms" if p95 is not None else "n/a"
+        lines.append(
+            f"🔌 **{backend.name}**: circuit {backend.breaker.state}, p95 {p95_text}, "
+            f"hedges {backend.hedge_wins}/{backend.hedges_sent} won"
+        )
+    lines.append(f"📖 **Wikipedia titles**: {title_index.resolved} resolved, {title_index.negative_hits} known-missing skips")
+    prompt_tokens = prompt_cache_stats["prompt_tokens"]
+    cached_share = prompt_cache_stats["cached_tokens"] / prompt_tokens if prompt_tokens else 0
+    lines.append(f"🗂️ **Prompt cache**: {prompt_cache_stats['cached_tokens']}/{prompt_tokens} input tokens cached ({cached_share:.0%})")
+    lines.append(f"🏁 **Model racing**: {llm_hedge_stats['won']}/{llm_hedge_stats['sent']} hedges won")
+    lines.append(f"🧪 **Research sessions**: {len(active_sessions)} active, {total_session_bytes() / 1024:.0f} KiB held")
+    
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+def command_tree_hash():
+    """Hash of the slash command definitions, used to skip redundant syncs."""
+    payload = []
+    for command in sorted(bot.tree.get_commands(), key=lambda c: c.name):
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:
+            # discord.py < 2.4 takes no tree argument
+            payload.append(command.to_dict())
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_commands():
+    """Sync the command tree only when its definitions changed since the last sync.
+
+    Runs as a background task, so failures are logged here rather than raised.
+    """
+    try:
+        # With several shard processes only the one holding shard 0 syncs;
+        # a plain Bot in single mode has no shard_ids
+        shard_ids = getattr(bot, "shard_ids", None)
+        if shard_ids and 0 not in shard_ids:
+            return
+        
+        current_hash = command_tree_hash()
+        hash_key = f"command_hash:{bot.application_id}"
+        if not FORCE_COMMAND_SYNC and await shared_cache.get("startup", hash_key) == current_hash:
+            log_event("commands.sync_skipped")
+            return
+        
+        synced = await bot.tree.sync()
+        await shared_cache.set("startup", hash_key, current_hash)
+        log_event("commands.synced", count=len(synced))
+    except Exception as e:
+        log_event("commands.sync_failed", "error", error=repr(e))
+
+async def run_health_checks():
+    """Check backends and warm clients in the background after startup."""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, get_groq_client)
     
     if supermemory and supermemory.enabled:
         test_result = await supermemory.test_connection()
         if test_result:
-            print(f'🧠 Supermemory: ✅ Connected')
+            log_event("supermemory.health", status="connected")
         else:
-            print(f'🧠 Supermemory: ❌ Connection failed')
+            log_event("supermemory.health", "warning", status="connection_failed")
     else:
-        print(f'🧠 Supermemory: ⚠️ Disabled (set SUPERMEMORY_API_KEY in .env)')
+        log_event("supermemory.health", status="disabled")
+
+@bot.event
+async def on_connect():
+    if "login" not in startup_timings and "started" in startup_timings:
+        startup_timings["login"] = time.perf_counter() - startup_timings["started"]
+
+@bot.event
+async def on_ready():
+    log_event("bot.online", user=str(bot.user))
+    if bot.shard_count:
+        log_event("bot.shards", shard_ids=bot.shard_ids or "all", shard_count=bot.shard_count)
     
-    try:
-        synced = await bot.tree.sync()
-        print(f'✅ Synced {len(synced)} command(s)')
-    except Exception as e:
-        print(f'❌ Failed to sync commands: {e}')
+    # on_ready fires again after reconnects; startup work only runs once
+    if "ready" in startup_timings:
+        return
+    
+    if "started" in startup_timings:
+        startup_timings["ready"] = time.perf_counter() - startup_timings["started"]
+        log_event("startup.timing", **{
+            f"{name}_s": round(startup_timings[name], 3) for name in ("import", "login", "ready") if name in startup_timings
+        })
+    
+    asyncio.create_task(sync_commands())
+    asyncio.create_task(run_health_checks())
+
+def extract_prompt(content):
+    """Strip the bot mention from a message's content."""
+    return content.replace(f'<@{bot.user.id}>', '').replace(f'<@!{bot.user.id}>', '').strip()
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
     if bot.user in message.mentions:
-        prompt = message.content.replace(f'<@{bot.user.id}>', '').strip()
+        prompt = extract_prompt(message.content)
         if prompt:
-            user_id = message.author.id
-            selected_model = user_model_preferences.get(user_id, "moonshotai/kimi-k2-instruct-0905")
-            await run_research(message.channel, prompt, selected_model, user_id)
+            await start_research(message, prompt)
+
+@bot.event
+async def on_raw_message_delete(payload):
+    tracked = find_tracked_session(payload.message_id)
+    if tracked:
+        tracked["task"].cancel()
+    else:
+        drop_follower(payload.message_id)
+
+@bot.event
+async def on_raw_message_edit(payload):
+    tracked = find_tracked_session(payload.message_id)
+    content = payload.data.get("content")
+    # Edits without content are embed unfurls, not user edits
+    if content is None:
+        return
+    
+    prompt = extract_prompt(content)
+    if tracked:
+        if normalize_prompt(prompt) == tracked["prompt"]:
+            return
+        tracked["task"].cancel()
+    elif not drop_follower(payload.message_id):
+        return
+    
+    if prompt and f'{bot.user.id}>' in content:
+        channel = bot.get_channel(payload.channel_id)
+        try:
+            message = await channel.fetch_message(payload.message_id)
+        except (AttributeError, discord.HTTPException):
+            return
+        await start_research(message, prompt)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    for tracked in list(tracked_sessions.values()):
+        if tracked["channel_id"] == channel.id:
+            tracked["followers"].clear()
+            tracked["task"].cancel()
+
+# --- CONVERSATION COMPACTION ---
+def queue_turns(cid, turns, front=False):
+    """Queue turns for compaction, keeping only the newest PENDING_COMPACTION_MAX
+    so a failing summary model cannot grow the transcript without bound."""
+    pending = pending_compaction.setdefault(cid, [])
+    if front:
+        pending[:0] = turns
+    else:
+        pending.extend(turns)
+    if len(pending) > PENDING_COMPACTION_MAX:
+        log_event("compaction.dropped", "warning", channel=cid, turns=len(pending) - PENDING_COMPACTION_MAX)
+        del pending[:-PENDING_COMPACTION_MAX]
+
+def record_turn(cid, prompt, answer):
+    """Append a turn to the channel history, queueing evicted turns for compaction."""
+    history = conversation_history.setdefault(cid, [])
+    history.append({"role": "user", "content": prompt})
+    history.append({"role": "assistant", "content": answer[:400]})
+    
+    if len(history) > HISTORY_WINDOW:
+        evicted = history[:-HISTORY_WINDOW]
+        conversation_history[cid] = history[-HISTORY_WINDOW:]
+        queue_turns(cid, evicted)
+        if cid not in compaction_tasks:
+            compaction_tasks[cid] = asyncio.create_task(compact_channel(cid))
+
+async def compact_channel(cid):
+    """Fold queued turns into the channel's rolling summary, off the response path."""
+    try:
+        while pending_compaction.get(cid):
+            turns = pending_compaction.pop(cid)
+            previous = channel_summaries.get(cid, "")
+            transcript = "\n".join(f"{turn['role'].title()}: {turn['content']}" for turn in turns)
+            try:
+                response = await create_completion(
+                    model=SUMMARY_MODEL,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": (
+                                "You maintain a running summary of a Discord conversation. Merge the new turns "
+                                "into the existing summary. Keep names, topics, facts and open questions; drop "
+                                f"pleasantries. Reply with the summary only, under {SUMMARY_TOKEN_BUDGET * 3 // 4} words."
+                            )
+                        },
+                        {"role": "user", "content": f"Existing summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"}
+                    ],
+                    temperature=0.1,
+                    max_tokens=SUMMARY_TOKEN_BUDGET
+                )
+                summary = clean_output(response.choices[0].message.content or "")
+            except Exception as e:
+                log_event("compaction.failed", "error", channel=cid, error=str(e))
+                # Keep the turns rather than losing them; retry with the next eviction
+                queue_turns(cid, turns, front=True)
+                return
+            if summary:
+                channel_summaries[cid] = summary[:SUMMARY_TOKEN_BUDGET * 4]
+    finally:
+        compaction_tasks.pop(cid, None)
+
+def summary_message(cid):
+    """The channel's rolling summary as a system message, or None."""
+    summary = channel_summaries.get(cid)
+    if not summary:
+        return None
+    return {"role": "system", "content": f"### EARLIER IN THIS CONVERSATION\n{summary}"}
+
+# --- CHANNEL WORKING SET ---
+class WorkingSet:
+    """Recently read pages and search results for one channel, bounded and expiring."""
+
+    def __init__(self):
+        self.items = OrderedDict()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, item in self.items.items() if now - item["at"] > WORKING_SET_TTL]:
+            del self.items[key]
+        while len(self.items) > WORKING_SET_SIZE:
+            self.items.popitem(last=False)
+
+    def _put(self, key, item):
+        item["at"] = time.monotonic()
+        self.items[key] = item
+        self.items.move_to_end(key)
+        self._prune()
+
+    def _get(self, key):
+        self._prune()
+        item = self.items.get(key)
+        if item:
+            self.items.move_to_end(key)
+        return item
+
+    @staticmethod
+    def _page_key(title):
+        # Same exact key as the title index, so differently cased articles stay apart
+        return ("page", TitleIndex.normalize(title))
+
+    def add_page(self, title, url, text):
+        self._put(self._page_key(title), {"title": title, "url": url, "text": text})
+
+    def add_search(self, query, text):
+        self._put(("search", ' '.join(query.lower().split())), {"query": query, "text": text})
+
+    def get_page(self, title):
+        return self._get(self._page_key(title))
+
+    def get_search(self, query):
+        return self._get(("search", ' '.join(query.lower().split())))
+
+    def context_message(self):
+        """List what is already available as a system message, or None."""
+        self._prune()
+        pages = [item for (kind, _), item in self.items.items() if kind == "page"]
+        searches = [item for (kind, _), item in self.items.items() if kind == "search"]
+        if not pages and not searches:
+            return None
+        
+        lines = ["### ALREADY READ IN THIS CHANNEL",
+                 "These are available instantly; reuse them before searching again."]
+        lines += [f"- Page: [{item['title']}]({item['url']})" for item in pages]
+        lines += [f"- Search: {item['query']}" for item in searches]
+        return {"role": "system", "content": "\n".join(lines)}
+
+channel_working_sets = OrderedDict()
+
+def get_working_set(cid):
+    """Get (or create) a channel's working set, evicting the least recently used channel."""
+    working_set = channel_working_sets.get(cid)
+    if working_set is None:
+        working_set = channel_working_sets[cid] = WorkingSet()
+        while len(channel_working_sets) > WORKING_SET_CHANNELS:
+            channel_working_sets.popitem(last=False)
+    channel_working_sets.move_to_end(cid)
+    return working_set
+
+# --- RESEARCH SESSIONS ---
+def message_bytes(message):
+    """Approximate in-memory size of one chat message."""
+    size = 64 + len(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or ():
+        size += 64 + len(tool_call["function"]["arguments"])
+    return size
+
+class ResearchSession:
+    """All per-request state of one run_research call, with byte accounting."""
+
+    __slots__ = (
+        "channel", "prompt", "model_name", "user_id", "container_tag", "deadline",
+        "messages", "display_sections", "sources", "failed_pages",
+        "tool_call_count", "pages_read", "has_planning", "has_synthesis",
+        "is_research_query", "embed", "reasoning_msg", "message_bytes", "section_bytes"
+    )
+
+    def __init__(self, channel, prompt, model_name, user_id, deadline):
+        self.channel = channel
+        self.prompt = prompt
+        self.model_name = model_name
+        self.user_id = user_id
+        self.container_tag = str(user_id)  # Using user_id as container tag
+        self.deadline = deadline
+        self.messages = []
+        self.display_sections = []
+        self.sources = {}
+        self.failed_pages = set()
+        self.tool_call_count = 0
+        self.pages_read = 0
+        self.has_planning = False
+        self.has_synthesis = False
+        self.is_research_query = False
+        self.embed = None
+        self.reasoning_msg = None
+        self.message_bytes = 0
+        self.section_bytes = 0
+
+    @property
+    def bytes_used(self):
+        """Everything this session holds, including embed text never sent to the model."""
+        return self.message_bytes + self.section_bytes
+
+    def add_message(self, message):
+        self.messages.append(message)
+        size = message_bytes(message)
+        self.message_bytes += size
+        session_memory["bytes"] += size
+        if total_session_bytes() > SESSION_MEMORY_CAP:
+            # Results the model has not read yet are still needed in full
+            self.release_tool_payloads(keep_last=self.unread_tool_results())
+
+    def add_section(self, section):
+        self.display_sections.append(section)
+        self.section_bytes += len(section)
+        session_memory["bytes"] += len(section)
+
+    def unread_tool_results(self):
+        """Number of tool results appended since the model last responded."""
+        count = 0
+        for message in reversed(self.messages):
+            if message["role"] != "tool":
+                break
+            count += 1
+        return count
+
+    def trim_messages(self, keep):
+        """Keep every system message and the last `keep` other messages, in order."""
+        others = [i for i, m in enumerate(self.messages) if m["role"] != "system"]
+        kept = set(others[-keep:])
+        self.messages = [m for i, m in enumerate(self.messages) if m["role"] == "system" or i in kept]
+        self._recount()
+
+    def release_tool_payloads(self, keep_last=None):
+        """Shrink tool results to short stubs once the model has summarized them.
+
+        By default every tool result before the latest <think> summary is released;
+        keep_last=N instead keeps only the newest N results intact.
+        """
+        tool_positions = [i for i, m in enumerate(self.messages) if m["role"] == "tool"]
+        if keep_last is None:
+            summarized = [
+                i for i, m in enumerate(self.messages)
+                if m["role"] == "assistant" and "<think" in (m.get("content") or "").lower()
+            ]
+            cutoff = summarized[-1] if summarized else 0
+            positions = [i for i in tool_positions if i < cutoff]
+        else:
+            positions = tool_positions[:max(0, len(tool_positions) - keep_last)]
+
+        for i in positions:
+            content = self.messages[i]["content"]
+            if len(content) > TOOL_STUB_CHARS:
+                self.messages[i] = dict(self.messages[i], content=content[:TOOL_STUB_CHARS] + " …[released]")
+        self._recount()
+
+    def _recount(self):
+        recounted = sum(message_bytes(m) for m in self.messages)
+        session_memory["bytes"] += recounted - self.message_bytes
+        self.message_bytes = recounted
+
+    async def update_ui(self, final=False):
+        seen = set()
+        unique_sections = []
+        for section in self.display_sections:
+            section_key = section[:100]
+            if section_key not in seen:
+                seen.add(section_key)
+                unique_sections.append(section)
+        
+        if final:
+            unique_sections = convert_to_past_tense(unique_sections)
+        
+        self.embed.description = "\n\n".join(unique_sections)[:4000]
+        try:
+            await self.reasoning_msg.edit(embed=self.embed)
+        except:
+            pass
+
+active_sessions = set()
+# Running total of bytes held by active sessions, kept in step by ResearchSession
+session_memory = {"bytes": 0}
+
+def total_session_bytes():
+    return session_memory["bytes"]
+
+# (user_id, channel_id) -> the research task currently answering that user there
+tracked_sessions = {}
+
+def normalize_prompt(prompt):
+    return ' '.join(prompt.lower().split())
+
+def find_tracked_session(message_id):
+    for tracked in tracked_sessions.values():
+        if tracked["message_id"] == message_id:
+            return tracked
+    return None
+
+def drop_follower(message_id):
+    """Forget a duplicate that was folded into another session; True if one was found."""
+    for tracked in tracked_sessions.values():
+        for follower in tracked["followers"]:
+            if follower[0].id == message_id:
+                tracked["followers"].remove(follower)
+                return True
+    return False
+
+async def start_research(message, prompt, followers=None):
+    """Run research for a message, replacing the user's superseded session in that
+    channel and folding exact duplicates into the session already running.
+    
+    If the session is cancelled, the first folded duplicate takes it over so
+    its author still gets an answer.
+    """
+    key = (message.author.id, message.channel.id)
+    normalized = normalize_prompt(prompt)
+    now = time.monotonic()
+    
+    for tracked in tracked_sessions.values():
+        if (tracked["channel_id"] == message.channel.id and tracked["prompt"] == normalized
+                and now - tracked["started"] < DUPLICATE_WINDOW_SECONDS):
+            tracked["followers"].append((message, prompt))
+            try:
+                await message.add_reaction("🔁")
+            except discord.HTTPException:
+                pass
+            return
+    
+    previous = tracked_sessions.get(key)
+    if previous:
+        previous["task"].cancel()
+    
+    user_id = message.author.id
+    selected_model = await get_user_model(user_id)
+    task = asyncio.create_task(run_research(message.channel, prompt, selected_model, user_id))
+    tracked = {
+        "task": task,
+        "message_id": message.id,
+        "channel_id": message.channel.id,
+        "prompt": normalized,
+        "started": now,
+        "followers": list(followers or [])
+    }
+    tracked_sessions[key] = tracked
+    try:
+        # wait() rather than await so a cancelled session does not cancel this handler
+        await asyncio.wait({task})
+        if not task.cancelled() and task.exception():
+            log_event("research.failed", "error", error=repr(task.exception()))
+    finally:
+        if tracked_sessions.get(key) is tracked:
+            del tracked_sessions[key]
+    
+    if task.cancelled():
+        # Users with a session of their own in this channel are not promoted
+        waiting = [f for f in tracked["followers"] if (f[0].author.id, f[0].channel.id) not in tracked_sessions]
+        if waiting:
+            successor, successor_prompt = waiting[0]
+            log_event("research.promoted", channel=successor.channel.id, waiting=len(waiting))
+            await start_research(successor, successor_prompt, followers=waiting[1:])
+
+async def send_answer(channel, text):
+    """Send an answer, splitting it into Discord-sized chunks."""
+    if len(text) > 2000:
+        chunks = [text[i:i+2000] for i in range(0, len(text), 2000)]
+        for chunk in chunks:
+            await channel.send(chunk)
+    else:
+        await channel.send(text)
+
+prompt_cache_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+
+async def create_completion(deadline=None, **kwargs):
+    """Run a Groq chat completion, paced by the model's governor and bounded by the
+    deadline. Cancelling the caller closes the request."""
+    from groq import APITimeoutError, RateLimitError
+    
+    client = get_groq_client()
+    governor = get_governor(kwargs["model"])
+    estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        await governor.acquire(estimated, deadline)
+        timeout = LLM_TIMEOUT if deadline is None else deadline.cap(LLM_TIMEOUT)
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        
+        started = time.monotonic()
+        try:
+            raw = await asyncio.wait_for(
+                client.chat.completions.with_raw_response.create(timeout=timeout, **kwargs),
+                timeout
+            )
+        except APITimeoutError as e:
+            raise asyncio.TimeoutError() from e
+        except RateLimitError as e:
+            governor.record_rejection(e.response.headers)
+            if attempt == RATE_LIMIT_RETRIES:
+                raise RateLimitedError(str(e)) from e
+            continue
+        
+        response = raw.parse()
+        elapsed = time.monotonic() - started
+        model_latency.setdefault(kwargs["model"], LatencyTracker()).record(elapsed)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        if usage:
+            prompt_cache_stats["prompt_tokens"] += usage.prompt_tokens
+            prompt_cache_stats["cached_tokens"] += cached_tokens
+        log_event(
+            "llm.completion",
+            model=kwargs["model"],
+            duration_ms=round(elapsed * 1000),
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            cached_tokens=cached_tokens,
+            completion_tokens=usage.completion_tokens if usage else None
+        )
+        governor.record_response(raw.headers, estimated, usage.total_tokens if usage else None)
+        return response
+
+# --- LLM RACING ---
+model_latency = {}
+llm_hedge_stats = {"sent": 0, "won": 0}
+guild_hedge_log = {}
+
+def alternate_model(model_name):
+    for candidate in AVAILABLE_MODELS.values():
+        if candidate != model_name:
+            return candidate
+    return None
+
+async def get_racing_settings(guild_id):
+    """Get a guild's racing settings, falling back to the environment defaults."""
+    stored = await shared_cache.get("racing", str(guild_id)) if guild_id else None
+    return stored or {"enabled": LLM_RACING, "hourly_limit": LLM_HEDGE_HOURLY_LIMIT}
+
+async def take_hedge_budget(guild_id, hourly_limit):
+    """Count one hedge against the guild's rolling hourly limit, if there is room.
+
+    The log is kept in the shared cache so all shard processes draw on one limit.
+    """
+    key = str(guild_id)
+    now = time.time()
+    stored = await shared_cache.get("hedge_log", key) if shared_cache.enabled else guild_hedge_log.get(key)
+    log = [at for at in stored or [] if at > now - 3600]
+    if len(log) >= hourly_limit:
+        return False
+    log.append(now)
+    guild_hedge_log[key] = log
+    await shared_cache.set("hedge_log", key, log, ttl=3600)
+    return True
+
+def is_valid_completion(response):
+    msg = response.choices[0].message
+    return bool(msg.content or msg.tool_calls)
+
+async def race_completion(session, deadline, **kwargs):
+    """Completion for latency-critical calls: if the primary model is slower than its
+    observed p90, the alternate model is asked too and the first valid answer wins."""
+    primary_model = kwargs["model"]
+    tracker = model_latency.get(primary_model)
+    p90 = tracker.percentile(90) if tracker else None
+    alternate = alternate_model(primary_model)
+    guild = getattr(session.channel, 'guild', None)
+    guild_id = guild.id if guild else None
+    settings = await get_racing_settings(guild_id)
+    
+    if not settings["enabled"] or p90 is None or alternate is None:
+        return await create_completion(deadline, **kwargs)
+    
+    primary = asyncio.ensure_future(create_completion(deadline, **kwargs))
+    tasks = [primary]
+    fallback = None
+    last_error = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=p90)
+        if done or not await take_hedge_budget(guild_id, settings["hourly_limit"]):
+            return await primary
+        
+        llm_hedge_stats["sent"] += 1
+        hedge = asyncio.ensure_future(create_completion(deadline, **dict(kwargs, model=alternate)))
+        tasks.append(hedge)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                elif is_valid_completion(task.result()):
+                    if task is hedge:
+                        llm_hedge_stats["won"] += 1
+                    return task.result()
+                else:
+                    fallback = task.result()
+    finally:
+        # Cancelling closes the losing request; its estimate stays charged to the
+        # governor since the prompt has already been sent
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    
+    if fallback is not None:
+        return fallback
+    raise last_error
+
+async def force_synthesis(session):
+    """Get an immediate final answer from whatever research has been gathered."""
+    session.add_message({
+        "role": "user",
+        "content": "Time is up. Stop researching and give your final answer now from what you have gathered, with citations."
+    })
+    try:
+        response = await race_completion(
+            session,
+            session.deadline,
+            model=session.model_name,
+            messages=session.messages,
+            tools=get_tools(include_memory=memory_enabled()),
+            tool_choice="none",
+            temperature=0.2,
+            max_tokens=800
+        )
+        answer = clean_output(response.choices[0].message.content or "")
+    except Exception as e:
+        log_event("synthesis.failed", "error", error=str(e))
+        answer = ""
+    return answer or "I ran out of time before I could finish researching this."
+
+def answer_cache_key(model_name, prompt):
+    """Normalize a prompt so trivially different phrasings share an answer."""
+    return f"{model_name}:{' '.join(prompt.lower().split())}"
 
 async def run_research(channel, prompt, model_name, user_id):
+    guild = getattr(channel, 'guild', None)
+    session = ResearchSession(channel, prompt, model_name, user_id, Deadline(await get_time_budget(guild.id if guild else None)))
+    active_sessions.add(session)
+    # Every log record from this task and the tasks it spawns carries these IDs
+    session_id_var.set(uuid.uuid4().hex[:12])
+    user_id_var.set(str(user_id))
+    started = time.monotonic()
+    log_event("research.start", channel=channel.id, model=model_name)
+    try:
+        await research_loop(session)
+        log_event(
+            "research.complete",
+            duration_ms=round((time.monotonic() - started) * 1000),
+            pages=session.pages_read,
+            tools=session.tool_call_count,
+            bytes=session.bytes_used
+        )
+    except asyncio.CancelledError:
+        log_event("research.cancelled", duration_ms=round((time.monotonic() - started) * 1000))
+        if session.reasoning_msg is not None:
+            session.embed.title = "⏹️ Research Cancelled"
+            session.embed.color = 0x99AAB5
+            try:
+                await session.reasoning_msg.edit(embed=session.embed)
+            except discord.HTTPException:
+                pass
+        raise
+    finally:
+        active_sessions.discard(session)
+        session_memory["bytes"] -= session.bytes_used
+
+async def research_loop(session):
+    channel = session.channel
+    prompt = session.prompt
+    model_name = session.model_name
+    container_tag = session.container_tag
+    deadline = session.deadline
+    # Calls made while researching must leave the final synthesis its slice
+    work_deadline = deadline.reserving(FORCE_SYNTHESIS_SECONDS)
     cid = channel.id
-    container_tag = str(user_id)  # Using user_id as container tag
     
     if cid not in conversation_history:
         conversation_history[cid] = []
@@ -604,8 +2285,15 @@ async def run_research(channel, prompt, model_name, user_id):
     # Get user profile and search memory if Supermemory is enabled
     context_from_memory = ""
     if supermemory and supermemory.enabled:
-        # Get profile with search in one call
-        profile_data = await supermemory.get_profile(container_tag, query=prompt)
+        # When the local mirror answers confidently the profile lookup needs no
+        # query and is served from the profile cache; otherwise Supermemory is
+        # searched too and its results are reconciled into the mirror
+        local_memories = await memory_mirror.search(container_tag, prompt, limit=3)
+        if memory_mirror.is_confident(local_memories):
+            profile_data = await supermemory.get_profile(container_tag, deadline=work_deadline)
+        else:
+            # Get profile with search in one call
+            profile_data = await supermemory.get_profile(container_tag, query=prompt, deadline=work_deadline)
         
         if profile_data:
             profile = profile_data.get('profile', {})
@@ -625,6 +2313,9 @@ async def run_research(channel, prompt, model_name, user_id):
             # If search results were included
             search_results = profile_data.get('searchResults', {}).get('results', [])
             if search_results:
+                await memory_mirror.ingest(container_tag, search_results)
+                # Remote results supersede weaker local matches
+                local_memories = []
                 memory_texts = []
                 for result in search_results[:3]:
                     if 'memory' in result:
@@ -634,79 +2325,91 @@ async def run_research(channel, prompt, model_name, user_id):
                 
                 if memory_texts:
                     context_from_memory += "\n\n**Relevant Memories:**\n" + "\n".join(f"- {mem}" for mem in memory_texts)
+        
+        if local_memories:
+            context_from_memory += "\n\n**Relevant Memories:**\n" + "\n".join(f"- {mem['memory'][:200]}" for mem in local_memories)
     
-    system_prompt = get_system_prompt(model_name, has_memory=(supermemory and supermemory.enabled))
+    system_prompt = get_system_prompt(model_name, has_memory=memory_enabled())
     
-    # Add memory context to system prompt if available
-    if context_from_memory:
-        system_prompt += f"\n\n### USER CONTEXT FROM MEMORY\n{context_from_memory}\n"
+    recent_context = conversation_history[cid][-HISTORY_WINDOW:] if conversation_history[cid] else []
+    earlier_context = summary_message(cid)
     
-    recent_context = conversation_history[cid][-4:] if conversation_history[cid] else []
+    # Context-free questions can reuse an answer produced by any shard
+    answer_key = answer_cache_key(model_name, prompt)
+    cacheable = not recent_context and not earlier_context and not context_from_memory
+    if cacheable:
+        cached_answer = await shared_cache.get("answer", answer_key)
+        if cached_answer:
+            record_turn(cid, prompt, cached_answer)
+            await send_answer(channel, cached_answer)
+            return
     
-    messages = [
-        {"role": "system", "content": system_prompt}
-    ] + recent_context + [
-        {"role": "user", "content": prompt}
-    ]
+    # Most stable first: the shared system prompt, then channel context, then the
+    # per-user memory context right before the prompt
+    session.add_message({"role": "system", "content": system_prompt})
+    if earlier_context:
+        session.add_message(earlier_context)
+    for message in recent_context:
+        session.add_message(message)
+    working_set = get_working_set(cid)
+    working_context = working_set.context_message()
+    if working_context:
+        session.add_message(working_context)
+    if context_from_memory:
+        session.add_message({"role": "system", "content": f"### USER CONTEXT FROM MEMORY\n{context_from_memory}"})
+    session.add_message({"role": "user", "content": prompt})
     
-    embed = discord.Embed(title="Reasoning", color=0x5865F2)
-    reasoning_msg = await channel.send(embed=embed)
+    session.embed = discord.Embed(title="Reasoning", color=0x5865F2)
+    session.reasoning_msg = await channel.send(embed=session.embed)
     
-    display_sections = []
-    sources = {}
-    failed_pages = set()
-    tool_call_count = 0
     max_tools = 12
-    
-    has_planning = False
-    has_synthesis = False
-    pages_read = 0
-    is_research_query = False
     is_llama = "llama" in model_name.lower()
 
-    async def update_ui(final=False):
-        seen = set()
-        unique_sections = []
-        for section in display_sections:
-            section_key = section[:100]
-            if section_key not in seen:
-                seen.add(section_key)
-                unique_sections.append(section)
+    final_answer = None
+    for iteration in range(30):
+        if deadline.remaining() <= FORCE_SYNTHESIS_SECONDS:
+            break
         
-        if final:
-            unique_sections = convert_to_past_tense(unique_sections)
+        # Shrink the remaining work as the time budget runs out
+        min_pages, max_tokens = research_limits(deadline)
         
-        embed.description = "\n\n".join(unique_sections)[:4000]
-        try:
-            await reasoning_msg.edit(embed=embed)
-        except:
-            pass
-
-    for iteration in range(30):
-        if len(str(messages)) > 20000:
-            messages = [messages[0]] + messages[-12:]
+        # Page extracts the model has already summarized are no longer needed
+        session.release_tool_payloads()
+        # Only what is sent to the model counts toward trimming
+        if session.message_bytes > 20000:
+            session.trim_messages(12)
         
+        request = dict(
+            model=model_name,
+            messages=session.messages,
+            tools=get_tools(include_memory=memory_enabled()),
+            tool_choice="auto",
+            temperature=0.2,
+            max_tokens=max_tokens
+        )
         try:
-            response = groq_client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                tools=get_tools(include_memory=(supermemory and supermemory.enabled)),
-                tool_choice="auto",
-                temperature=0.2,
-                max_tokens=2000
-            )
+            # The opening plan and the final answer are what users wait on most
+            if iteration == 0 or session.has_synthesis:
+                response = await race_completion(session, work_deadline, **request)
+            else:
+                response = await create_completion(work_deadline, **request)
+        except asyncio.TimeoutError:
+            break
+        except RateLimitedError:
+            await channel.send("⚠️ AskLab is receiving too many requests right now. Please try again shortly.")
+            return
         except Exception as e:
             error_msg = str(e)
             
             if "tool_use_failed" in error_msg and is_llama:
-                messages.append({
+                session.add_message({
                     "role": "user",
                     "content": "ERROR: Separate <think> and tool calls. ONE per response."
                 })
                 continue
-            elif "rate_limit" in error_msg.lower() or "413" in error_msg or "too large" in error_msg.lower():
+            elif "413" in error_msg or "too large" in error_msg.lower():
                 await channel.send(f"⚠️ Context too large. Trimming...")
-                messages = [messages[0]] + messages[-8:]
+                session.trim_messages(8)
                 continue
             else:
                 await channel.send(f"⚠️ API Error: {e}")
@@ -719,14 +2422,14 @@ async def run_research(channel, prompt, model_name, user_id):
         
         think = extract_reasoning(content)
         if think:
-            is_research_query = True
+            session.is_research_query = True
             header, body = parse_thinking_with_header(think)
             
             if header:
                 if "Planning" in header or "planning" in header.lower():
-                    has_planning = True
+                    session.has_planning = True
                 elif "Synthesiz" in header or "synthesiz" in header.lower():
-                    has_synthesis = True
+                    session.has_synthesis = True
             
             if body and len(body) > 500:
                 body = body[:500] + "..."
@@ -738,29 +2441,29 @@ async def run_research(channel, prompt, model_name, user_id):
             else:
                 thinking_section = f"🧠 **Thought**\n\n> {think[:500]}"
             
-            display_sections.append(thinking_section)
-            await update_ui()
+            session.add_section(thinking_section)
+            await session.update_ui()
 
         tool_calls = msg.tool_calls
         
         if tool_calls:
-            is_research_query = True
+            session.is_research_query = True
         
         if hallucinated and not tool_calls:
-            messages.append({"role": "assistant", "content": content})
-            messages.append({"role": "user", "content": "ERROR: Use native API only."})
+            session.add_message({"role": "assistant", "content": content})
+            session.add_message({"role": "user", "content": "ERROR: Use native API only."})
             continue
         
         if is_llama and think and tool_calls:
-            messages.append({"role": "assistant", "content": content})
-            messages.append({
+            session.add_message({"role": "assistant", "content": content})
+            session.add_message({
                 "role": "user",
                 "content": "ERROR: NEVER combine <think> and tool calls."
             })
             continue
         
-        if not has_planning and tool_calls and iteration == 0:
-            messages.append({
+        if not session.has_planning and tool_calls and iteration == 0:
+            session.add_message({
                 "role": "assistant",
                 "content": content,
                 "tool_calls": [
@@ -768,14 +2471,14 @@ async def run_research(channel, prompt, model_name, user_id):
                     for tc in tool_calls
                 ]
             })
-            messages.append({
+            session.add_message({
                 "role": "user",
                 "content": "ERROR: Start with <think>**Planning**</think> FIRST."
             })
             continue
         
         if tool_calls:
-            messages.append({
+            session.add_message({
                 "role": "assistant",
                 "content": content,
                 "tool_calls": [
@@ -785,18 +2488,18 @@ async def run_research(channel, prompt, model_name, user_id):
             })
             
             for tool_call in tool_calls:
-                tool_call_count += 1
+                session.tool_call_count += 1
                 
-                if tool_call_count > max_tools:
+                if session.tool_call_count > max_tools:
                     error_msg = "⚠️ **Tool Limit Reached**"
-                    messages.append({
+                    session.add_message({
                         "role": "tool",
                         "tool_call_id": tool_call.id,
                         "name": tool_call.function.name,
                         "content": "Maximum tools. Synthesize and answer now."
                     })
-                    display_sections.append(error_msg)
-                    await update_ui()
+                    session.add_section(error_msg)
+                    await session.update_ui()
                     continue
                 
                 fn_name = tool_call.function.name
@@ -805,7 +2508,7 @@ async def run_research(channel, prompt, model_name, user_id):
                     fn_args = json.loads(tool_call.function.arguments)
                 except json.JSONDecodeError:
                     result = "ERROR: Invalid arguments"
-                    messages.append({
+                    session.add_message({
                         "role": "tool",
                         "tool_call_id": tool_call.id,
                         "name": fn_name,
@@ -818,14 +2521,15 @@ async def run_research(channel, prompt, model_name, user_id):
                         result = "Memory search unavailable. Enable Supermemory to use this feature."
                     else:
                         query = fn_args.get('query', '')
-                        display_sections.append(f"🧠 **Searching Memory...**\n\n> {query}")
-                        await update_ui()
+                        session.add_section(f"🧠 **Searching Memory...**\n\n> {query}")
+                        await session.update_ui()
                         
                         # Search memory with user filter
                         memories = await supermemory.search_memory(
                             query=query,
                             container_tag=container_tag,
-                            limit=3
+                            limit=3,
+                            deadline=work_deadline
                         )
                         
                         if memories:
@@ -855,39 +2559,54 @@ async def run_research(channel, prompt, model_name, user_id):
                 
                 elif fn_name == "search_wikipedia":
                     query = fn_args.get('query', '')
-                    display_sections.append(f"🔍 **Searching Wikipedia...**\n\n> {query}")
-                    await update_ui()
-                    result = await search_wikipedia(query)
+                    session.add_section(f"🔍 **Searching Wikipedia...**\n\n> {query}")
+                    await session.update_ui()
+                    recalled = working_set.get_search(query)
+                    if recalled:
+                        result = recalled["text"]
+                    else:
+                        result = await search_wikipedia(query, deadline=work_deadline)
+                        if not result.startswith(("Search failed", "No results found")):
+                            working_set.add_search(query, result)
                     
                 elif fn_name == "get_wikipedia_page":
-                    title = fn_args.get('title', '')
+                    # Cite the canonical title when the index knows it
+                    title = title_index.resolve(fn_args.get('title', ''))
                     
-                    if title in failed_pages:
+                    if title in session.failed_pages:
                         result = f"Already tried '{title}'."
-                        messages.append({
+                        session.add_message({
                             "role": "tool",
                             "tool_call_id": tool_call.id,
                             "name": fn_name,
                             "content": result
                         })
-                        display_sections.append(f"⚠️ **Skipped Duplicate**\n\n> {title}")
-                        await update_ui()
+                        session.add_section(f"⚠️ **Skipped Duplicate**\n\n> {title}")
+                        await session.update_ui()
                         continue
                     
                     wiki_url = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
-                    display_sections.append(f"📖 **Reading Article...**\n\n- [{title}]({wiki_url})")
-                    await update_ui()
-                    result = await get_wikipedia_page(title)
+                    session.add_section(f"📖 **Reading Article...**\n\n- [{title}]({wiki_url})")
+                    await session.update_ui()
+                    
+                    # Pages read earlier in this channel cost nothing to reuse
+                    recalled = working_set.get_page(title)
+                    if recalled:
+                        result = recalled["text"]
+                    else:
+                        result = await get_wikipedia_page(title, deadline=work_deadline)
                     
                     if "Failed" in result or "not found" in result or "no readable text" in result:
-                        failed_pages.add(title)
+                        session.failed_pages.add(title)
                     else:
-                        pages_read += 1
-                        sources[title] = wiki_url
+                        session.pages_read += 1
+                        session.sources[title] = wiki_url
+                        if not recalled:
+                            working_set.add_page(title, wiki_url, result)
                 else:
                     result = "ERROR: Unknown function"
                 
-                messages.append({
+                session.add_message({
                     "role": "tool",
                     "tool_call_id": tool_call.id,
                     "name": fn_name,
@@ -897,95 +2616,102 @@ async def run_research(channel, prompt, model_name, user_id):
         else:
             final_answer = clean_output(content)
             
-            if is_research_query:
-                if pages_read < 3 and not has_synthesis:
-                    messages.append({"role": "assistant", "content": content})
-                    messages.append({
+            if session.is_research_query:
+                if session.pages_read < min_pages and not session.has_synthesis:
+                    session.add_message({"role": "assistant", "content": content})
+                    session.add_message({
                         "role": "user",
-                        "content": f"Read {3 - pages_read} more page(s)."
+                        "content": f"Read {min_pages - session.pages_read} more page(s)."
                     })
+                    final_answer = None
                     continue
                 
-                if not has_synthesis and final_answer.strip() and pages_read >= 3:
-                    messages.append({"role": "assistant", "content": content})
-                    messages.append({
+                if not session.has_synthesis and final_answer.strip() and session.pages_read >= min_pages:
+                    session.add_message({"role": "assistant", "content": content})
+                    session.add_message({
                         "role": "user",
                         "content": "Use <think> to synthesize findings briefly."
                     })
+                    final_answer = None
                     continue
             
             if not final_answer.strip():
                 if iteration < 28:
-                    messages.append({"role": "assistant", "content": content})
-                    messages.append({
+                    session.add_message({"role": "assistant", "content": content})
+                    session.add_message({
                         "role": "user",
                         "content": "Provide final answer with citations."
                     })
+                    final_answer = None
                     continue
                 else:
                     final_answer = "I apologize, but I wasn't able to find a clear answer."
             
-            # Add sources to final answer
-            if sources and is_research_query:
-                final_answer += "\n\n📚 **Sources**"
-                for idx, (title, url) in enumerate(sorted(sources.items()), 1):
-                    final_answer += f"\n{idx}. [{title}]({url})"
-            
-            # Save to Supermemory if enabled and it's a meaningful interaction
-            if supermemory and supermemory.enabled and final_answer and len(final_answer) > 50:
-                # Prepare memory content - store the conversation exchange
-                memory_content = f"User: {prompt}\n\nAssistant: {final_answer[:1500]}"
-                
-                # Prepare metadata
-                metadata = {
-                    "timestamp": datetime.now().isoformat(),
-                    "model": model_name,
-                    "type": "research_qa" if is_research_query else "conversation",
-                    "channel_id": str(cid),
-                    "sources_count": len(sources) if sources else 0
-                }
-                
-                # Save asynchronously without blocking
-                asyncio.create_task(supermemory.add_memory(
-                    content=memory_content,
-                    container_tag=container_tag,
-                    metadata=metadata
-                ))
-                print(f"💾 Saving to memory for user {user_id}")
-            
-            # Update conversation history
-            conversation_history[cid].append({"role": "user", "content": prompt})
-            conversation_history[cid].append({"role": "assistant", "content": final_answer[:400]})
-            
-            # Trim conversation history
-            if len(conversation_history[cid]) > 6:
-                conversation_history[cid] = conversation_history[cid][-6:]
-            
-            # Update UI to show completion
-            embed.title = "✅ Reasoning Complete"
-            embed.color = 0x57F287
-            await update_ui(final=True)
-            
-            # Send final answer
-            if len(final_answer) > 2000:
-                chunks = [final_answer[i:i+2000] for i in range(0, len(final_answer), 2000)]
-                for chunk in chunks:
-                    await channel.send(chunk)
-            else:
-                await channel.send(final_answer)
-            
-            return
+            break
     
-    # If loop exhausted
-    await channel.send("⚠️ Reasoning exceeded maximum iterations.")
+    # Out of iterations or time: answer from whatever was gathered
+    forced = final_answer is None
+    if forced:
+        session.add_section("⏱️ **Time Budget Reached**")
+        await session.update_ui()
+        final_answer = await force_synthesis(session)
+    
+    # Add session.sources to final answer
+    if session.sources and session.is_research_query:
+        final_answer += "\n\n📚 **Sources**"
+        for idx, (title, url) in enumerate(sorted(session.sources.items()), 1):
+            final_answer += f"\n{idx}. [{title}]({url})"
+    
+    # Save to Supermemory if enabled and it's a meaningful interaction
+    if supermemory and supermemory.enabled and final_answer and len(final_answer) > 50:
+        # Prepare memory content - store the conversation exchange
+        memory_content = f"User: {prompt}\n\nAssistant: {final_answer[:1500]}"
+        
+        # Prepare metadata
+        metadata = {
+            "timestamp": datetime.now().isoformat(),
+            "model": model_name,
+            "type": "research_qa" if session.is_research_query else "conversation",
+            "channel_id": str(cid),
+            "sources_count": len(session.sources) if session.sources else 0
+        }
+        
+        # Save asynchronously without blocking
+        asyncio.create_task(supermemory.add_memory(
+            content=memory_content,
+            container_tag=container_tag,
+            metadata=metadata
+        ))
+        log_event("memory.saving")
+    
+    if cacheable and session.is_research_query and session.sources and not forced:
+        await shared_cache.set("answer", answer_key, final_answer, ANSWER_CACHE_TTL)
+    
+    # Update conversation history; older turns are summarized in the background
+    record_turn(cid, prompt, final_answer)
+    
+    # Update UI to show completion
+    session.embed.title = "✅ Reasoning Complete"
+    session.embed.color = 0x57F287
+    await session.update_ui(final=True)
+    
+    # Send final answer
+    await send_answer(channel, final_answer)
 
-if __name__ == "__main__":
+def main(import_seconds=None):
     if not DISCORD_BOT_TOKEN:
-        print("❌ Error: DISCORD_BOT_TOKEN not set in .env file")
+        log_event("startup.config_missing", "error", setting="DISCORD_BOT_TOKEN")
         exit(1)
     if not GROQ_API_KEY:
-        print("❌ Error: GROQ_API_KEY not set in .env file")
+        log_event("startup.config_missing", "error", setting="GROQ_API_KEY")
         exit(1)
     
-    print("🚀 Starting Discord bot...")
+    if import_seconds is not None:
+        startup_timings["import"] = import_seconds
+    startup_timings["started"] = time.perf_counter()
+    
+    log_event("startup.begin")
     bot.run(DISCORD_BOT_TOKEN)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,128 @@
 #!/usr/bin/env python3
 """
 AskLab AI Bot Entry Point - main.py
-Simple entry point that runs app.py
+Imports and runs app.py, or supervises one app.py worker per shard group
+when SHARD_MODE=process.
 """
 
 import os
 import sys
+import math
+import signal
+import subprocess
+import time
+
+import requests
+from dotenv import load_dotenv
 
 # Ensure project root is in path
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+RESTART_BACKOFF_MAX = 60
+STABLE_RUN_SECONDS = 300
+IDENTIFY_DELAY = 5
+
+
+def resolve_shard_count():
+    """Use SHARD_COUNT if set, otherwise ask Discord for its recommendation."""
+    configured = int(os.getenv('SHARD_COUNT') or 0)
+    if configured:
+        return configured
+
+    try:
+        response = requests.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {os.getenv('DISCORD_BOT_TOKEN')}"},
+            timeout=10
+        )
+        if response.status_code == 200:
+            return int(response.json().get("shards", 1))
+        print(f"⚠️ Gateway lookup failed: {response.status_code}, using 1 shard")
+    except Exception as e:
+        print(f"⚠️ Gateway lookup error: {e}, using 1 shard")
+    return 1
+
+
+def shard_groups(shard_count):
+    """Split shard ids into one group per worker process."""
+    per_process = int(os.getenv('SHARDS_PER_PROCESS') or 0)
+    if not per_process:
+        per_process = math.ceil(shard_count / (os.cpu_count() or 1))
+    return [list(range(i, min(i + per_process, shard_count))) for i in range(0, shard_count, per_process)]
+
+
+def spawn_worker(shard_ids, shard_count, worker_count):
+    env = dict(os.environ)
+    env.update({
+        "SHARD_MODE": "process",
+        "SHARD_COUNT": str(shard_count),
+        "SHARD_IDS": ",".join(str(i) for i in shard_ids),
+        # Workers share one Groq key and split its quota
+        "SHARD_WORKERS": str(worker_count)
+    })
+    print(f"🧩 Starting worker for shards {shard_ids}")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+
+def run_supervisor():
+    """Start one worker per shard group and restart any that exit."""
+    shard_count = resolve_shard_count()
+    groups = shard_groups(shard_count)
+    print(f"🚀 Supervising {len(groups)} worker(s) for {shard_count} shard(s)")
+
+    workers = {}
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers.values():
+            if worker["process"].poll() is None:
+                worker["process"].terminate()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for index, group in enumerate(groups):
+        if index:
+            # Discord only accepts one IDENTIFY per few seconds
+            time.sleep(IDENTIFY_DELAY)
+        workers[index] = {"shards": group, "process": spawn_worker(group, shard_count, len(groups)),
+                          "started": time.time(), "backoff": 1}
+
+    while not stopping:
+        time.sleep(1)
+        for worker in workers.values():
+            code = worker["process"].poll()
+            if code is None or stopping:
+                continue
+
+            if time.time() - worker["started"] > STABLE_RUN_SECONDS:
+                worker["backoff"] = 1
+            print(f"⚠️ Worker for shards {worker['shards']} exited ({code}), restarting in {worker['backoff']}s")
+            time.sleep(worker["backoff"])
+            if stopping:
+                break
+            worker["backoff"] = min(worker["backoff"] * 2, RESTART_BACKOFF_MAX)
+            worker["process"] = spawn_worker(worker["shards"], shard_count, len(groups))
+            worker["started"] = time.time()
+
+    for worker in workers.values():
+        try:
+            worker["process"].wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker["process"].kill()
+
+
 # Run app.py
 if __name__ == "__main__":
-    exec(open(os.path.join(PROJECT_ROOT, "app.py")).read())
+    load_dotenv()
+    if os.getenv('SHARD_MODE', 'single').lower() == "process" and not os.getenv('SHARD_IDS'):
+        run_supervisor()
+    else:
+        # A normal import lets Python reuse app.py's cached bytecode
+        import_started = time.perf_counter()
+        import app
+        app.main(import_seconds=time.perf_counter() - import_started)